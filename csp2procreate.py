@@ -3,10 +3,13 @@
 from __future__ import annotations
 
 import argparse
+import bisect
 import datetime as _dt
 import hashlib
 import io
-import shutil
+import mmap
+import multiprocessing
+import os
 import sqlite3
 import struct
 import sys
@@ -14,56 +17,135 @@ import tempfile
 import time
 import uuid
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List
+from typing import BinaryIO, Iterator, List
 from plistlib import UID
 import plistlib
-import tkinter as tk
-from tkinter import filedialog
 from PIL import Image, ImageChops, ImageOps, ImageFilter
 
 # ---------------------------------------------------------------------------
 # Helper constants -----------------------------------------------------------
 # ---------------------------------------------------------------------------
 
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
 IEND_MARKER = b"IEND"
 SQLITE_MAGIC = b"SQLite format 3"  
+COPY_CHUNK = 1 << 20  # 1 MiB buffer when streaming the sqlite payload
+
+# CSP brush size thresholds (px) → spacing fudge factor for csp_to_plotSpacing
+SPACING_SIZE_STEPS = (50, 100)
+SPACING_FUDGE      = (0.15, 0.3, 0.6)
+
+# Seed.brush members that build_brush regenerates; the rest are copied as-is
+EDITED_MEMBERS = {"Shape.png", "Brush.archive", "QuickLook/Thumbnail.png", "Title.txt"}
+# PNGs we encode ourselves — PIL already zlib-compressed them
+STORED_MEMBERS = {"Shape.png", "QuickLook/Thumbnail.png"}
+
+# Variant columns consumed by the mapping helpers below
+VARIANT_COLUMNS = (
+    "BrushSize",
+    "BrushInterval",
+    "BrushFlow",
+    "BrushUseWaterColor",
+    "BrushMixColor",
+    "BrushMixAlpha",
+    "BrushRotation",
+    "BrushRotationEffector",
+    "BrushRotationInSpray",
+    "BrushRotationRandomInSpray",
+    "BrushRotationRandomScale",
+    "BrushUseSpray",
+    "BrushPatternOrderType",
+    "BrushRevision",
+    "BrushUseIn",
+    "BrushUseOut",
+    "BrushInLength",
+    "BrushOutLength",
+)
 
 # ---------------------------------------------------------------------------
 # Stage 1 - PNG extraction helpers -------------------------------------------
 # ---------------------------------------------------------------------------
 
-def prepare_shape(src: Path, dest: Path) -> None:
+def prepare_shape(stamp: Image.Image, dest: Path | BinaryIO) -> None:
     """
-    Convert CSP stamp → Procreate tip
+    Convert CSP stamp (RGBA) → Procreate tip
     """
-    im = Image.open(src).convert("RGBA")
-    r, g, b, a = im.split()
-    gray = Image.merge("RGB", (r, g, b)).convert("L")
-    inv = ImageOps.invert(gray)
-    mask = ImageChops.multiply(inv, a)
+    inv = ImageOps.invert(stamp.convert("L"))
+    mask = ImageChops.multiply(inv, stamp.getchannel("A"))
 
     mask.save(dest, format="PNG")   # L-mode PNG
 
-def locate_sqlite_offset(data: bytes) -> int:
+def locate_sqlite_offset(data: bytes | mmap.mmap) -> int:
     off = data.find(SQLITE_MAGIC)
     if off == -1:
         raise ValueError("SQLite header not found — is this a .sut file?")
     return off
 
 def dump_sqlite_blob(sut_path: Path) -> Path:
-    raw = sut_path.read_bytes()
-    off = locate_sqlite_offset(raw)
-    tmp = Path(tempfile.mktemp(suffix=".sqlite"))
-    tmp.write_bytes(raw[off:])
+    """
+    Stream the embedded SQLite database out of the .sut into a temp file
+    without loading the whole brush into memory.
+    """
+    with open(sut_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            off = locate_sqlite_offset(mm)
+        f.seek(off)
+        tmp = Path(tempfile.mktemp(suffix=".sqlite"))
+        with open(tmp, "wb") as out:
+            while chunk := f.read(COPY_CHUNK):
+                out.write(chunk)
     return tmp
 
+@contextmanager
+def open_sut_database(sut_path: Path) -> Iterator[sqlite3.Connection]:
+    """
+    Open the SQLite database embedded in a .sut.
+
+    On Python 3.11+ the payload is deserialized straight from a read-only
+    mmap of the .sut. Older Pythons, and WAL-mode payloads (which
+    deserialize can't read), fall back to a temp file via dump_sqlite_blob.
+    """
+    sqlite_tmp = None
+    con = None
+    if hasattr(sqlite3.Connection, "deserialize"):
+        with open(sut_path, "rb") as f, \
+             mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            off = locate_sqlite_offset(mm)
+            if mm[off + 18:off + 20] == b"\x01\x01":   # rollback journal, not WAL
+                con = sqlite3.connect(":memory:")
+                try:
+                    with memoryview(mm)[off:] as payload:
+                        con.deserialize(payload)
+                except sqlite3.Error:
+                    # let the temp-file path have a go at a payload sqlite
+                    # refuses to deserialize
+                    con.close()
+                    con = None
+    if con is None:
+        sqlite_tmp = dump_sqlite_blob(sut_path)
+        try:
+            con = sqlite3.connect(sqlite_tmp)
+        except BaseException:
+            sqlite_tmp.unlink(missing_ok=True)
+            raise
+    try:
+        yield con
+    finally:
+        con.close()
+        if sqlite_tmp is not None:
+            sqlite_tmp.unlink(missing_ok=True)
+
 def _extract_png_from_layer(blob: bytes) -> bytes:
-    pos_png = blob.rfind(b"PNG")
-    if pos_png <= 0:
+    # the stamp is the last PNG in the layer blob (a preview may precede it);
+    # end the slice at that stream's own IEND
+    begin = blob.rfind(PNG_SIGNATURE)
+    if begin == -1:
         raise RuntimeError("PNG signature not found in layer blob")
-    begin = pos_png - 1
-    pos_iend = blob.rfind(IEND_MARKER)
+    pos_iend = blob.find(IEND_MARKER, begin)
     if pos_iend == -1:
         raise RuntimeError("IEND marker not found in layer blob")
     end = pos_iend + 4
@@ -76,23 +158,28 @@ def get_seed_path() -> Path:
         base = Path(__file__).parent
     return base / "Seed.brush"
 
-def write_quicklook_thumbnail(bundle_dir: Path, original_stamp_png: Path) -> None:
-    ql_dir = bundle_dir / "QuickLook"
-    ql_dir.mkdir(exist_ok=True)
+def write_quicklook_thumbnail(dest: Path | BinaryIO, stamp: Image.Image) -> None:
+    """
+    Render the RGBA stamp centred on the 1060×324 QuickLook/Thumbnail.png
+    """
     thumb_w, thumb_h = 1060, 324
     bg = Image.new("RGBA", (thumb_w, thumb_h), (0, 0, 0, 0))  # transparent
-    stamp = Image.open(original_stamp_png).convert("RGBA")
-    scale = thumb_h / stamp.height
+    # only ever shrink; BOX is plenty for a downscaled preview
+    scale = min(1.0, thumb_h / stamp.height)
     new_w = int(stamp.width * scale)
     new_h = int(stamp.height * scale)
-    stamp = stamp.resize((new_w, new_h), Image.LANCZOS)
+    if scale < 1.0:
+        stamp = stamp.resize((new_w, new_h), Image.Resampling.BOX)
     x_pos = (thumb_w - new_w) // 2
     y_pos = (thumb_h - new_h) // 2
     bg.alpha_composite(stamp, (x_pos, y_pos))
-    (ql_dir / "Thumbnail.png").write_bytes(b"")  # clear old file if exists
-    bg.save(ql_dir / "Thumbnail.png", "PNG")
+    bg.save(dest, "PNG")
     
 def pick_files():
+    # Tk is only needed for the double-click flow; importing it spins up Tcl
+    import tkinter as tk
+    from tkinter import filedialog
+
     root = tk.Tk()
     root.withdraw()
     sut_path = filedialog.askopenfilename(
@@ -107,24 +194,22 @@ def pick_files():
         sys.exit("No output folder selected.")
     return Path(sut_path), Path(dest_dir)
 
-def extract_pngs_from_sut(sut_path: Path, dest_dir: Path) -> List[Path]:
+def extract_pngs_from_sut(con: sqlite3.Connection, dest_dir: Path) -> List[Path]:
+    """
+    Extract every stamp PNG from the .sut database opened by open_sut_database
+    """
     dest_dir.mkdir(parents=True, exist_ok=True)
-    sqlite_tmp = dump_sqlite_blob(sut_path)
 
     paths: List[Path] = []
+    cur = con.cursor()
     try:
-        con = sqlite3.connect(sqlite_tmp)
-        cur = con.cursor()
-
         try:
-            rows = cur.execute("SELECT _PW_ID, FileData FROM MaterialFile").fetchall()
+            rows = cur.execute("SELECT _PW_ID, FileData FROM MaterialFile")
         except sqlite3.OperationalError:
             # Table not found — unusual .sut layout
             return []
 
-        if not rows:
-            return []
-
+        # iterate the cursor so only one layer blob is held at a time
         for idx, (_id, blob) in enumerate(rows):
             try:
                 png_bytes = _extract_png_from_layer(blob)
@@ -135,12 +220,7 @@ def extract_pngs_from_sut(sut_path: Path, dest_dir: Path) -> List[Path]:
                 print(f"[WARN] layer {_id} skipped: {exc}")
 
     finally:
-        try:
-            cur.close()
-            con.close()
-        except Exception:
-            pass
-        sqlite_tmp.unlink(missing_ok=True)
+        cur.close()
 
     return paths
 
@@ -148,44 +228,88 @@ def extract_pngs_from_sut(sut_path: Path, dest_dir: Path) -> List[Path]:
 # Stage 2 - Create Brush -----------------------------------------------------
 # ---------------------------------------------------------------------------
 
-def read_variant_row(sqlite_path: Path):
+def read_variant_row(con: sqlite3.Connection):
     """
     Helper function to read the variant row from the .sut (sql) database
     """
-    con = sqlite3.connect(sqlite_path)
-    row = con.execute("SELECT * FROM Variant LIMIT 1").fetchone()
-    names = [d[1] for d in con.execute("PRAGMA table_info('Variant')")]
-    con.close()
+    try:
+        cur = con.execute(f"SELECT {', '.join(VARIANT_COLUMNS)} FROM Variant LIMIT 1")
+    except sqlite3.OperationalError:
+        # older .sut without some of the columns — take whatever is there
+        cur = con.execute("SELECT * FROM Variant LIMIT 1")
+    row = cur.fetchone()
+    names = [d[0] for d in cur.description]
+    cur.close()
     return dict(zip(names, row))
     
-def csp_to_plotSpacing(variant):
-    size_px     = variant.get("BrushSize", 1) or 1
-    interval_px = variant.get("BrushInterval", 0) or 0
-
+@dataclass(frozen=True, slots=True)
+class BrushParams:
+    """
+    The Variant fields the mapping helpers need, unpacked and normalised
+    once per .sut instead of once per stamp.
+    """
+    size_px: float               = 1
+    interval_px: float           = 0
+    flow: float                  = 0      # raw BrushFlow, 0 when unset
+    use_watercolor: bool         = False
+    mix_color: float             = 0.0
+    mix_alpha: float             = 0.0
+    rotation: float              = 0.0
+    random_rotation: bool        = False
+    pattern_random: bool         = False  # BrushPatternOrderType == 3
+    rotation_random_scale: float = 0.0
+    jitter: float                = 0.0
+    taper: bool                  = False
+    in_length: float             = 0
+    out_length: float            = 0
+    angle_sensitive: bool        = False
+
+    @classmethod
+    def from_variant(cls, variant: dict) -> "BrushParams":
+        random_in_spray = variant.get("BrushRotationRandomInSpray")
+        return cls(
+            size_px=variant.get("BrushSize", 1) or 1,
+            interval_px=variant.get("BrushInterval", 0) or 0,
+            flow=variant.get("BrushFlow") or 0,
+            use_watercolor=bool(variant.get("BrushUseWaterColor", 0)),
+            mix_color=float(variant.get("BrushMixColor", 0) or 0),
+            mix_alpha=float(variant.get("BrushMixAlpha", 0) or 0),
+            rotation=float(variant.get("BrushRotation")),
+            random_rotation=bool(
+                not (random_in_spray == 0)
+                and variant.get("BrushUseSpray")
+                and variant.get("BrushRotationInSpray")
+            ),
+            pattern_random=variant.get("BrushPatternOrderType", 0) == 3,
+            rotation_random_scale=variant.get("BrushRotationRandomScale", 0)/100,
+            jitter=(variant.get("BrushRevision")/100)*2,
+            taper=bool(variant.get("BrushUseIn") or variant.get("BrushUseOut")),
+            in_length=variant.get("BrushInLength"),
+            out_length=variant.get("BrushOutLength"),
+            angle_sensitive=variant.get("BrushRotationEffector") == 3,
+        )
+
+def csp_to_plotSpacing(params: BrushParams):
+    size_px = params.size_px
     if size_px <= 0:
         return 0.01
-    raw_spacing = interval_px / size_px
+    raw_spacing = params.interval_px / size_px
 
     # Adjust fudge factor: larger brushes can have higher spacing multipliers
-    if size_px < 50:
-        fudge_factor = 0.15
-    elif size_px < 100:
-        fudge_factor = 0.3
-    else:
-        fudge_factor = 0.6
+    fudge_factor = SPACING_FUDGE[bisect.bisect_right(SPACING_SIZE_STEPS, size_px)]
 
     adjusted_spacing = raw_spacing * fudge_factor
     return max(0.01, min(1.0, adjusted_spacing))
 
 
-def map_csp_rendering_flags(variant):
+def map_csp_rendering_flags(params: BrushParams):
     """
     Helper function to somewhat map to procreates rendering settings
     """
-    use_watercolor = bool(variant.get("BrushUseWaterColor", 0))
-    mix_color      = float(variant.get("BrushMixColor", 0.0) or 0)
-    mix_alpha      = float(variant.get("BrushMixAlpha", 0.0) or 0)
-    brush_flow     = float(variant.get("BrushFlow", 1.0) or 1.0)
+    use_watercolor = params.use_watercolor
+    mix_color      = params.mix_color
+    mix_alpha      = params.mix_alpha
+    brush_flow     = float(params.flow or 1.0)
 
     # -- Light Glaze --
     flags = {
@@ -212,14 +336,14 @@ def map_csp_rendering_flags(variant):
 
     return flags
 
-def map_csp_to_wet_mix(variant):
+def map_csp_to_wet_mix(params: BrushParams):
     """
     Helper function to somewhat map to procreates wet-mix settings
     """
-    use_wc   = bool(variant.get("BrushUseWaterColor", 0))
-    mix_col  = float(variant.get("BrushMixColor", 0) or 0)
-    mix_alpha= float(variant.get("BrushMixAlpha", 0) or 0)
-    flow     = float(variant.get("BrushFlow", 100) or 100)
+    use_wc   = params.use_watercolor
+    mix_col  = params.mix_color
+    mix_alpha= params.mix_alpha
+    flow     = float(params.flow or 100)
     nc = max(0.0, min(1.0, mix_col/100.0))
     na = max(0.0, min(1.0, mix_alpha/100.0))
     nf = max(0.0, min(1.0, flow/100.0))
@@ -246,17 +370,15 @@ def map_csp_to_wet_mix(variant):
     }
 
 
-def finalise_seed_brush(bundle_dir: Path, stamp_png: Path, new_name: str, sql_tmp: Path | None = None) -> None:
-    """
-    bundle_dir contains Brush.archive and the freshly-copied Shape.png
-    stamp_png  : path to the stamp (already grayscale or not)
-    new_name   : visible name in Brush Library
-    sql_tmp:   : path to the .sut file to access all it's properties
+def finalise_seed_brush(archive_bytes: bytes, new_name: str, params: BrushParams) -> bytes:
     """
-    Image.open(stamp_png).convert("L").save(bundle_dir / "Shape.png")
+    archive_bytes : Brush.archive of the seed brush (binary plist)
+    new_name      : visible name in Brush Library
+    params        : brush settings unpacked from the .sut Variant row
 
-    plist_path = bundle_dir / "Brush.archive"
-    root       = plistlib.load(plist_path.open("rb"))
+    Returns the patched Brush.archive.
+    """
+    root       = plistlib.loads(archive_bytes)
     objs       = root["$objects"]
 
     def resolve(val):
@@ -268,145 +390,125 @@ def finalise_seed_brush(bundle_dir: Path, stamp_png: Path, new_name: str, sql_tm
     # 2 ─ bump creation timestamp & rename brush
     stamped, renamed = False, False
     now = float(time.time())
-    variant = read_variant_row(sql_tmp)
-    spacing = csp_to_plotSpacing(variant)
+    spacing = csp_to_plotSpacing(params)
     min_px, max_px, opacity = 0.02, 3.0, 1.0
-    flow_val = variant.get("BrushFlow",  1000)
-    flow_val = max(0, min(1000, flow_val))
-    randomized  = variant.get("BrushRotationRandomInSpray")
-    BrushUseSpray  = variant.get("BrushUseSpray")
-    BrushRotationInSpray  = variant.get("BrushRotationInSpray")
-    if not (randomized == 0) and BrushUseSpray and BrushRotationInSpray:
-        randomized = True
-    else:
-        randomized = False
-    BrushRotation = variant.get("BrushRotation")
-    BrushPatternOrderType = variant.get("BrushPatternOrderType", 0)
-    BrushRotationRandomScale = variant.get("BrushRotationRandomScale", 0)/100
-    interval_px = variant.get("BrushInterval")
-    BrushSprayBias  = variant.get("BrushSprayBias")
-    jitter_val  = (variant.get("BrushRevision")/100)*2
-    BrushUseIn  = variant.get("BrushUseIn")
-    BrushUseOut  = variant.get("BrushUseOut")
-    BrushInLength  = variant.get("BrushInLength")
-    BrushOutLength  = variant.get("BrushOutLength")
-    BrushInRatio  = variant.get("BrushInRatio")
-    BrushOutRatio  = variant.get("BrushOutRatio")
-    render_flags = map_csp_rendering_flags(variant)
-    wetMix_flags = map_csp_to_wet_mix(variant)
-    angle_sensitive = variant.get("BrushRotationEffector") == 3
+    render_flags = map_csp_rendering_flags(params)
+    wetMix_flags = map_csp_to_wet_mix(params)
+
+    # brush key → new value, applied to every dict that already has the key
+    patch = {
+        "plotSpacing": float(spacing),                  # (c) spacing
+        "minSize": float(min_px),                       # (d) minSize
+        "maxSize": float(max_px),                       # (e) maxSize
+        "maxOpacity": float(opacity),                   # (f) opacity
+        "shapeRotation": params.rotation,               # (g) rotation
+        "shapeRandomise": params.random_rotation,       # (h) randomized
+        "shapeFlipXJitter": params.pattern_random,      # (j) FlipX
+        "plotJitter": float(params.jitter),             # (k) jitter
+        "taperPressure": float(0),                      # (l) Taper
+        # (m) render mode
+        "renderingMaxTransfer": render_flags['renderingMaxTransfer'],
+        "renderingModulatedTransfer": render_flags['renderingModulatedTransfer'],
+        "renderingRecursiveMixing": render_flags['renderingRecursiveMixing'],
+        # (n) wet-mix
+        "dynamicsMix": float(wetMix_flags['wetMixDilution']),
+        "dynamicsLoad": float(wetMix_flags['wetMixCharge']),
+        "dynamicsPressureMix": float(wetMix_flags['wetMixAttack']),
+        "dynamicsWetAccumulation": float(wetMix_flags['wetMixPull']),
+    }
+    if params.taper:
+        patch["pencilTaperStartLength"] = float((params.in_length/100)/4)
+        patch["pencilTaperEndLength"] = float((params.out_length/100)/2)
+    if params.angle_sensitive:
+        # (o) shape input-style for angle sensitivity
+        patch["shapeAzimuth"] = True
+        patch["shapeRoll"] = True
+        patch["shapeRollMode"] = 1
+        patch["shapeOrientation"] = 1
+    # (i) scatter is written alongside shapeRandomise
+    scatter = float(params.rotation_random_scale) if params.pattern_random else float(0)
+    pending = set(patch)    # keys not placed yet
 
     for obj in objs:
         if not isinstance(obj, dict):
             continue
 
+        # plistlib always decodes dict keys to str, so no bytes-key variants
         # (a) creationDate → NS.time
-        if not stamped and ("creationDate" in obj or b"creationDate" in obj):
-            cd = resolve(obj.get("creationDate") or obj.get(b"creationDate"))
-            if isinstance(cd, dict) and ("NS.time" in cd or b"NS.time" in cd):
-                key = "NS.time" if "NS.time" in cd else b"NS.time"
-                cd[key] = now
+        if not stamped and "creationDate" in obj:
+            cd = resolve(obj["creationDate"])
+            if isinstance(cd, dict) and "NS.time" in cd:
+                cd["NS.time"] = now
                 stamped = True
 
         # (b) visible name
-        if not renamed and ("name" in obj or b"name" in obj):
-            objs[obj.get("name")] = new_name
+        if not renamed and "name" in obj:
+            objs[obj["name"]] = new_name
             renamed  = True
-            
-        # (c) spacing
-        if "plotSpacing" in obj:
-            obj["plotSpacing"] = float(spacing)
-            
-        # (d) minSize
-        if "minSize" in obj:
-            obj["minSize"] = float(min_px)
-            
-        # (e) maxSize
-        if "maxSize" in obj:
-            obj["maxSize"] = float(max_px)
-            
-        # (f) opacity
-        if "maxOpacity" in obj:
-            obj["maxOpacity"] = float(opacity)
-            
-        # (g) rotation
-        if "shapeRotation" in obj:
-            obj["shapeRotation"] = float(BrushRotation)
-            
-        # (h) randomized
-        if "shapeRandomise" in obj:
-            obj["shapeRandomise"] = randomized  
-            
-        # (i) scatter
-        if "shapeRandomise" in obj:
-            if BrushPatternOrderType == 3:
-                obj["shapeScatter"] = float(BrushRotationRandomScale)
-            else:
-                obj["shapeScatter"] = float(0)
-                
-        # (j) FlipX
-        if "shapeFlipXJitter" in obj and BrushPatternOrderType == 3:
-            obj["shapeFlipXJitter"] = True
-        elif "shapeFlipXJitter" in obj and not BrushPatternOrderType == 3:
-            obj["shapeFlipXJitter"] = False
-            
-        # (k) jitter
-        if "plotJitter" in obj:
-            obj["plotJitter"] = float(jitter_val) 
-            
-        # (l) Taper
-        if "taperPressure" in obj:
-            obj["taperPressure"] = float(0)
-        if BrushUseIn or BrushUseOut:
-            if "pencilTaperStartLength" in obj:
-                obj["pencilTaperStartLength"] = float((BrushInLength/100)/4)
-            if "pencilTaperEndLength" in obj:
-                obj["pencilTaperEndLength"] = float((BrushOutLength/100)/2)
-                
-        # (m) render mode
-        if "renderingMaxTransfer" in obj:
-            obj["renderingMaxTransfer"] = render_flags['renderingMaxTransfer']
-        if "renderingModulatedTransfer" in obj:
-            obj["renderingModulatedTransfer"] = render_flags['renderingModulatedTransfer']
-        if "renderingRecursiveMixing" in obj:
-            obj["renderingRecursiveMixing"] = render_flags['renderingRecursiveMixing']
-            
-        # (n) wet-mix
-        if "dynamicsMix" in obj:
-            obj["dynamicsMix"] = float(wetMix_flags['wetMixDilution'])
-        if "dynamicsLoad" in obj:
-            obj["dynamicsLoad"] = float(wetMix_flags['wetMixCharge'])
-        if "dynamicsPressureMix" in obj:
-            obj["dynamicsPressureMix"] = float(wetMix_flags['wetMixAttack'])
-        if "dynamicsWetAccumulation" in obj:
-            obj["dynamicsWetAccumulation"] = float(wetMix_flags['wetMixPull'])
-            
-        # (o) shape input-style for angle sensitivity
-        if angle_sensitive:
-            if "shapeAzimuth" in obj:
-                obj["shapeAzimuth"] = True
-            if "shapeRoll" in obj:
-                obj["shapeRoll"] = True
-            if "shapeRollMode" in obj:
-                obj["shapeRollMode"] = 1
-            if "shapeOrientation" in obj:
-                obj["shapeOrientation"] = 1
-
-        if stamped and renamed:
+
+        hits = patch.keys() & obj.keys()
+        for k in hits:
+            obj[k] = patch[k]
+        if "shapeRandomise" in hits:
+            obj["shapeScatter"] = scatter
+        pending -= hits
+
+        # the archive holds one canonical brush dict — stop walking the
+        # remaining strings/UIDs/class refs once everything is placed
+        if stamped and renamed and not pending:
             break
 
-    plistlib.dump(root, plist_path.open("wb"), fmt=plistlib.FMT_BINARY)
+    return plistlib.dumps(root, fmt=plistlib.FMT_BINARY)
+
+def copy_zip_member(zin: zipfile.ZipFile, info: zipfile.ZipInfo,
+                    zout: zipfile.ZipFile, arcname: str) -> None:
+    """
+    Copy one member from *zin* to *zout* as *arcname* without inflating and
+    re-deflating it: the compressed payload and its CRC are moved verbatim.
+    zipfile has no public API for this, so the local header is written the
+    same way ZipFile.mkdir() does it.
+    """
+    zin.fp.seek(info.header_offset)
+    header = zin.fp.read(zipfile.sizeFileHeader)
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    zin.fp.seek(name_len + extra_len, io.SEEK_CUR)
+    payload = zin.fp.read(info.compress_size)
+
+    out = zipfile.ZipInfo(arcname, date_time=info.date_time)
+    out.compress_type = info.compress_type
+    out.CRC           = info.CRC
+    out.compress_size = info.compress_size
+    out.file_size     = info.file_size
+    out.external_attr = info.external_attr
+    out.flag_bits     = info.flag_bits & ~0x08   # sizes/CRC live in the header
+
+    with zout._lock:
+        zout.fp.seek(zout.start_dir)
+        out.header_offset = zout.fp.tell()
+        zout._writecheck(out)
+        zout._didModify = True
+        zout.fp.write(out.FileHeader())
+        zout.fp.write(payload)
+        zout.filelist.append(out)
+        zout.NameToInfo[out.filename] = out
+        zout.start_dir = zout.fp.tell()
+
+def member_compression(name: str) -> int:
+    """zip compression for a .brush member (see STORED_MEMBERS)"""
+    return zipfile.ZIP_STORED if name in STORED_MEMBERS else zipfile.ZIP_DEFLATED
 
 def build_brush(
     shape_png: Path,
     brush_out: Path,
     seed_brush: Path,
     display_name: str | None = None,
-    sql_tmp: Path | None = None,
-) -> None:
+    params: BrushParams | None = None,
+) -> dict[str, bytes]:
     """
     Create a Procreate **.brush** by copying *seed_brush* and replacing its
-    Shape.png with *shape_png*.
+    Shape.png with *shape_png*. Returns the members that differ from the
+    seed (name → data) so a .brushset can be assembled without re-reading
+    the file.
 
     Parameters
     ----------
@@ -415,60 +517,75 @@ def build_brush(
     seed_brush    A previously-exported brush that acts as a template.
     display_name  Optional filename shown inside Procreate’s library; if None
                   we derive it from `brush_out.stem`.
-    sql_tmp       Path of the .sut file to access further brush properties.
+    params        Brush settings unpacked from the .sut Variant row.
     """
-    tmp_dir = brush_out.parent / f".tmp_{uuid.uuid4().hex}"
-    tmp_dir.mkdir(parents=True, exist_ok=True)
-
-    # 1. Unzip seed into temp dir
-    with zipfile.ZipFile(seed_brush) as z:
-        z.extractall(tmp_dir)
-
-    # 3. Update Name, prepare the brush stamp and edit its properties
-    if display_name:
-        (tmp_dir / "Title.txt").write_text(display_name)
-    tmp_shape = tmp_dir / "Shape.png"
-    write_quicklook_thumbnail(tmp_dir, shape_png)
-    prepare_shape(shape_png, tmp_shape) 
-    finalise_seed_brush(tmp_dir, tmp_shape, display_name, sql_tmp)
-
-    # 4. Re-zip → .brush
-    with zipfile.ZipFile(brush_out, "w", compression=zipfile.ZIP_DEFLATED) as z:
-        for item in tmp_dir.rglob("*"):
-            z.write(item, arcname=item.relative_to(tmp_dir))
-
-    shutil.rmtree(tmp_dir, ignore_errors=True)
+    # decode the stamp once for both the tip and the thumbnail
+    with Image.open(shape_png) as im:
+        stamp = im.convert("RGBA")
+
+    with zipfile.ZipFile(seed_brush) as zin, \
+         zipfile.ZipFile(brush_out, "w", compression=zipfile.ZIP_DEFLATED) as zout:
+        # 1. Copy every seed member we don't edit straight across, still
+        #    compressed and with its stored CRC
+        for info in zin.infolist():
+            if info.filename not in EDITED_MEMBERS:
+                copy_zip_member(zin, info, zout, info.filename)
+
+        # 3. Update Name, prepare the brush stamp and edit its properties
+        thumb = io.BytesIO()
+        write_quicklook_thumbnail(thumb, stamp)
+        shape = io.BytesIO()
+        prepare_shape(stamp, shape)
+        archive = finalise_seed_brush(
+            zin.read("Brush.archive"), display_name, params or BrushParams()
+        )
+
+        # 4. Add the edited members → .brush
+        edited = {
+            "Brush.archive": archive,
+            "Shape.png": shape.getvalue(),
+            "QuickLook/Thumbnail.png": thumb.getvalue(),
+        }
+        if display_name:
+            edited["Title.txt"] = display_name.encode()
+        for name, data in edited.items():
+            zout.writestr(name, data, compress_type=member_compression(name))
+
     print(
         f"✓ built .brush ({shape_png.name}) → {brush_out.name}  "
         f"[{_dt.datetime.now().strftime('%H:%M:%S')}]"
     )
+    return edited
 
-def build_brushset(brush_files: List[Path], set_out: Path, set_name: str) -> None:
+def build_brushset(
+    brushes: List[dict[str, bytes]], seed_brush: Path, set_out: Path, set_name: str
+) -> None:
     """
-    • brush_files : list of finished .brush files (zip archives)
+    Bundle the brushes build_brush produced into one .brushset, straight
+    from memory instead of reading the finished .brush files back.
+
+    • brushes     : edited members of each brush (name → data)
+    • seed_brush  : the template the brushes were built from; its untouched
+                    members are copied over still compressed
     • set_out     : final .brushset path
     • set_name    : name shown in Procreate’s Brush Library
     """
-    tmp_set = Path(tempfile.mkdtemp())
     uuids   = []
-    for bf in brush_files:
-        uid = str(uuid.uuid4()).upper()
-        uuids.append(uid)
-        dest_dir = tmp_set / uid
-        dest_dir.mkdir()
-
-        # unzip .brush into its UUID folder
-        with zipfile.ZipFile(bf) as zf:
-            zf.extractall(dest_dir)
-    plist_path = tmp_set / "brushset.plist"
-    plist_path.write_bytes(
-        plistlib.dumps({"name": set_name, "brushes": uuids}, fmt=plistlib.FMT_XML)
-    )
-    with zipfile.ZipFile(set_out, "w", zipfile.ZIP_DEFLATED) as z:
-        for item in tmp_set.rglob("*"):
-            z.write(item, arcname=item.relative_to(tmp_set))
+    with zipfile.ZipFile(seed_brush) as zin, \
+         zipfile.ZipFile(set_out, "w", zipfile.ZIP_DEFLATED) as z:
+        shared = [i for i in zin.infolist() if i.filename not in EDITED_MEMBERS]
+        for members in brushes:
+            uid = str(uuid.uuid4()).upper()
+            uuids.append(uid)
+            for info in shared:
+                copy_zip_member(zin, info, z, f"{uid}/{info.filename}")
+            for name, data in members.items():
+                z.writestr(f"{uid}/{name}", data, compress_type=member_compression(name))
+        z.writestr(
+            "brushset.plist",
+            plistlib.dumps({"name": set_name, "brushes": uuids}, fmt=plistlib.FMT_BINARY),
+        )
 
-    shutil.rmtree(tmp_set, ignore_errors=True)
     print(f"✓ built brush-set → {set_out.name}")
 
 def main(argv: List[str] | None = None) -> None:
@@ -487,45 +604,51 @@ def main(argv: List[str] | None = None) -> None:
     out  = Path(dest).resolve()
     out.mkdir(parents=True, exist_ok=True)
 
-    # 1) extract stamps + keep sqlite tmp for parameter mapping
+    # 1) extract stamps + read the parameters for the mapping
     png_dir = out / sut.stem
     png_dir.mkdir(parents=True, exist_ok=True)
-    pngs = extract_pngs_from_sut(sut, png_dir)
-    if not pngs:
-        raise SystemExit("No PNG stamps found in the .sut")
-
-    sqlite_tmp = dump_sqlite_blob(sut)
-
-    built_paths: list[Path] = []
-    try:
-        # 2) build a brush per stamp
-        for i, stamp in enumerate(pngs, start=1):
-            if len(pngs) == 1:
-                brush_path = out / f"{sut.stem}.brush"
-                display_name = sut.stem
-            else:
-                brush_path = out / f"{sut.stem}_{i}.brush"
-                display_name = f"{sut.stem} {i}"
-            build_brush(
-                shape_png=stamp,
-                brush_out=brush_path,
-                seed_brush=seed,
-                display_name=f"{sut.stem} {i}",
-                sql_tmp=sqlite_tmp,
-            )
-            built_paths.append(brush_path)
-
-        # 3) bundle as .brushset when there’s more than one
-        if len(built_paths) > 1:
-            set_path = out / f"{sut.stem}.brushset"
-            build_brushset(built_paths, set_path, sut.stem)
-            print(f"✓ bundled {len(built_paths)} brushes into {set_path.name}")
+    with open_sut_database(sut) as con:
+        pngs = extract_pngs_from_sut(con, png_dir)
+        if not pngs:
+            raise SystemExit("No PNG stamps found in the .sut")
+        params = BrushParams.from_variant(read_variant_row(con))
+
+    # 2) build a brush per stamp — independent, so spread over processes
+    jobs = []
+    for i, stamp in enumerate(pngs, start=1):
+        if len(pngs) == 1:
+            brush_path = out / f"{sut.stem}.brush"
+            display_name = sut.stem
         else:
-            print(f"✓ generated single brush → {built_paths[0].name}")
-    finally:
-        # 4) cleanup
-        sqlite_tmp.unlink(missing_ok=True)
+            brush_path = out / f"{sut.stem}_{i}.brush"
+            display_name = f"{sut.stem} {i}"
+        jobs.append(dict(
+            shape_png=stamp,
+            brush_out=brush_path,
+            seed_brush=seed,
+            display_name=f"{sut.stem} {i}",
+            params=params,
+        ))
+
+    workers = min(len(jobs), os.cpu_count() or 1)
+    if workers == 1:
+        # a one-worker pool only adds process start-up on top of the work
+        built_members = [build_brush(**job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            futures = [ex.submit(build_brush, **job) for job in jobs]
+            built_members = [f.result() for f in futures]
+    built_paths: list[Path] = [job["brush_out"] for job in jobs]
+
+    # 3) bundle as .brushset when there’s more than one
+    if len(built_paths) > 1:
+        set_path = out / f"{sut.stem}.brushset"
+        build_brushset(built_members, seed, set_path, sut.stem)
+        print(f"✓ bundled {len(built_paths)} brushes into {set_path.name}")
+    else:
+        print(f"✓ generated single brush → {built_paths[0].name}")
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()   # worker processes in the packaged exe
     main()